@@ -8,16 +8,37 @@ BASE_DIR = Path(__file__).parent.parent
 # Document and storage paths
 DOCS_DIR = BASE_DIR / "docs"
 CHROMADB_DIR = BASE_DIR / "data" / "chromadb"
+MODELS_DIR = BASE_DIR / "data" / "models"
 
 # Chunking parameters
 CHUNK_SIZE = 1000  # characters
-CHUNK_OVERLAP = 200  # characters
+CHUNK_OVERLAP_SENTENCES = 1  # sentences repeated at the start of the next chunk
+MIN_PAGE_CHARS = 20  # pages with less extracted text are skipped
 
-# Embedding model (fast, good quality, runs locally)
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Embedding model (fast, good quality on domain text, runs locally)
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+# Instruction prepended to questions (not documents) for BGE retrieval
+EMBEDDING_QUERY_PROMPT = "Represent this sentence for searching relevant passages: "
+EMBEDDING_BATCH_SIZE = 64  # chunks per encoder forward pass
+# Chunks embedded and added to ChromaDB at a time; each add is one SQLite
+# write, so fewer, larger batches cut per-transaction overhead
+INGEST_BATCH_SIZE = 16 * EMBEDDING_BATCH_SIZE
+
+# INT8 ONNX quantization used for CPU inference. The export is built once
+# under MODELS_DIR. Use "avx2" or "arm64" on CPUs without AVX-512 VNNI.
+EMBEDDING_ONNX_QUANTIZATION = "avx512_vnni"
 
 # ChromaDB collection name
 COLLECTION_NAME = "scheme_compliance"
 
+# HNSW index settings for the collection
+HNSW_SPACE = "cosine"
+HNSW_M = 32  # graph links per node
+HNSW_CONSTRUCTION_EF = 200  # candidate list size while building
+HNSW_SEARCH_EF = 64  # candidate list size while querying
+
 # Query settings
 DEFAULT_TOP_K = 5
+MMR_FETCH_FACTOR = 4  # candidates fetched per returned result, for MMR reranking
+MMR_LAMBDA = 0.7  # 1.0 ranks purely by relevance, lower values favour diversity
+QUERY_CACHE_SIZE = 256  # query embeddings kept in memory for repeated questions
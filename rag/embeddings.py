@@ -0,0 +1,136 @@
+"""Embedding model loading shared by ingestion and querying."""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+from .config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_ONNX_QUANTIZATION,
+    MODELS_DIR,
+    QUERY_CACHE_SIZE,
+)
+
+ONNX_FILE = f"onnx/model_qint8_{EMBEDDING_ONNX_QUANTIZATION}.onnx"
+
+
+def quantized_onnx_model_dir(model_name=EMBEDDING_MODEL):
+    """Return a local copy of the model with its INT8 ONNX export.
+
+    The export is created on first use and reused afterwards.
+    """
+    model_dir = MODELS_DIR / model_name.replace("/", "--")
+    if not (model_dir / ONNX_FILE).exists():
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        model.save(str(model_dir))
+        export_dynamic_quantized_onnx_model(
+            model, EMBEDDING_ONNX_QUANTIZATION, str(model_dir)
+        )
+    return model_dir
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL):
+    """Load the sentence-transformer encoder for the best available device.
+
+    On CUDA the model runs in half precision: bf16 on Ampere and newer,
+    which have bf16 tensor cores, and fp16 on older GPUs. On CPU it runs through ONNX Runtime with an INT8-quantized
+    export of the model, which is considerably faster than fp32 PyTorch.
+    """
+    if torch.cuda.is_available():
+        # is_bf16_supported() also reports emulated bf16 on pre-Ampere GPUs
+        major, _ = torch.cuda.get_device_capability()
+        dtype = torch.bfloat16 if major >= 8 else torch.float16
+        return SentenceTransformer(
+            model_name,
+            device="cuda",
+            model_kwargs={"torch_dtype": dtype},
+        )
+
+    return SentenceTransformer(
+        str(quantized_onnx_model_dir(model_name)),
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": ONNX_FILE},
+    )
+
+
+def quantize_embeddings(embeddings):
+    """L2-normalize and scalar-quantize embeddings to int8, one scale per vector.
+
+    The int8 codes don't depend on a vector's norm, so normalization is
+    folded into the scale rather than done as a separate pass over the
+    matrix. Returns `(codes, scales)` where `codes * scales[:, None]`
+    approximates the normalized input.
+    """
+    absmax = np.abs(embeddings).max(axis=1)
+    norms = np.linalg.norm(embeddings, axis=1)
+    absmax[absmax == 0] = 1.0  # all-zero vectors quantize to zeros
+    norms[norms == 0] = 1.0
+
+    codes = embeddings * (127.0 / absmax)[:, None]
+    np.rint(codes, out=codes)
+    scales = absmax / (127.0 * norms)
+    return codes.astype(np.int8), scales
+
+
+def dequantize_embeddings(codes, scales):
+    """Reconstruct fp32 embeddings from `quantize_embeddings` output."""
+    return codes.astype(np.float32) * scales[:, None].astype(np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """Callable embedding texts with `load_embedding_model`.
+
+    `prompt` is prepended to every input, e.g. a query instruction.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, prompt=None):
+        self.model = load_embedding_model(model_name)
+        self.prompt = prompt
+
+    def __call__(self, input):
+        embeddings = self.model.encode(
+            list(input),
+            prompt=self.prompt,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return embeddings.tolist()
+
+
+class CachedEmbeddingFunction:
+    """LRU cache in front of another embedding function.
+
+    Texts are keyed on their stripped, lowercased form, so repeated or
+    trivially re-typed questions skip the encoder entirely.
+    """
+
+    def __init__(self, embedding_function, max_size=QUERY_CACHE_SIZE):
+        self.embedding_function = embedding_function
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def _key(text):
+        return hashlib.blake2b(text.strip().lower().encode()).digest()
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+
+        misses = {key: text for key, text in zip(keys, input) if key not in self._cache}
+        if misses:
+            embeddings = self.embedding_function(list(misses.values()))
+            for key, embedding in zip(misses, embeddings):
+                self._cache[key] = embedding
+
+        results = []
+        for key in keys:
+            self._cache.move_to_end(key)
+            results.append(self._cache[key])
+
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return results
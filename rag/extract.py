@@ -0,0 +1,78 @@
+"""PDF text extraction for the RAG system.
+
+Imports nothing from the embedding or vector store stack, so extraction
+worker processes stay small.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import fitz  # PyMuPDF
+from rich.console import Console
+
+from .config import MIN_PAGE_CHARS
+
+console = Console()
+
+# Only clip to the page; skip ligature and whitespace preservation and image
+# blocks, none of which survive chunking anyway
+TEXT_FLAGS = fitz.TEXT_MEDIABOX_CLIP
+
+
+def extract_text_from_pdf(pdf_path):
+    """Extract text from a PDF file, returning list of (page_num, text) tuples.
+
+    Page text holds one text block (roughly a paragraph) per line, with the
+    block's own line wrapping collapsed to spaces.
+    """
+    pages = []
+    try:
+        doc = fitz.open(pdf_path)
+        for page_num, page in enumerate(doc, start=1):
+            # Blocks are (x0, y0, x1, y1, text, block_no, block_type); type 1 is an image
+            blocks = [
+                " ".join(block[4].split())
+                for block in page.get_text("blocks", flags=TEXT_FLAGS)
+                if block[6] == 0
+            ]
+            text = "\n".join(block for block in blocks if block)
+            if len(text) >= MIN_PAGE_CHARS:
+                pages.append((page_num, text))
+        doc.close()
+    except Exception as e:
+        console.print(f"[red]Error reading {pdf_path.name}: {e}[/red]")
+    return pages
+
+
+def extract_all(pdf_files):
+    """Start extracting text from PDFs in parallel worker processes.
+
+    The first `max_workers` files are submitted before this returns, so the
+    workers are already running. Returns an iterator of `(pdf_path, pages)`
+    pairs in input order, so chunk ids are stable across runs. A new file is
+    submitted only as each result is consumed, so at most `max_workers`
+    extracted PDFs are held in memory. The pool shuts down once the iterator
+    is exhausted.
+    """
+    max_workers = min(os.cpu_count() or 1, len(pdf_files))
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    remaining = iter(pdf_files)
+    in_flight = deque(
+        (pdf_path, executor.submit(extract_text_from_pdf, pdf_path))
+        for pdf_path in islice(remaining, max_workers)
+    )
+
+    def iter_results():
+        with executor:
+            while in_flight:
+                pdf_path, future = in_flight.popleft()
+                # Refill before waiting, so the freed worker isn't left idle
+                for next_path in islice(remaining, 1):
+                    in_flight.append(
+                        (next_path, executor.submit(extract_text_from_pdf, next_path))
+                    )
+                yield pdf_path, future.result()
+
+    return iter_results()
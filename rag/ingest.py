@@ -1,53 +1,196 @@
 """PDF ingestion script for the RAG system."""
 
-import fitz  # PyMuPDF
-import chromadb
-from chromadb.utils import embedding_functions
+import base64
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import blingfire
 from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
+from rich.progress import (
+    Progress,
+    SpinnerColumn,
+    TextColumn,
+    BarColumn,
+    MofNCompleteColumn,
+)
 
 from .config import (
     DOCS_DIR,
     CHROMADB_DIR,
     CHUNK_SIZE,
-    CHUNK_OVERLAP,
-    EMBEDDING_MODEL,
+    CHUNK_OVERLAP_SENTENCES,
+    EMBEDDING_BATCH_SIZE,
+    INGEST_BATCH_SIZE,
     COLLECTION_NAME,
+    HNSW_SPACE,
+    HNSW_M,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_SEARCH_EF,
 )
+from .extract import extract_all
+
+# chromadb and rag.embeddings (torch, sentence-transformers) are imported
+# inside the functions that use them. Under spawn or forkserver, every
+# extraction worker re-imports this module as __mp_main__, and keeping that
+# stack out of module scope keeps the workers small.
 
 console = Console()
 
+# Stops at the first non-whitespace character instead of copying like strip()
+_HAS_CONTENT = re.compile(r"\S").search
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file, returning list of (page_num, text) tuples."""
-    pages = []
-    try:
-        doc = fitz.open(pdf_path)
-        for page_num, page in enumerate(doc, start=1):
-            text = page.get_text()
-            if text.strip():
-                pages.append((page_num, text))
-        doc.close()
-    except Exception as e:
-        console.print(f"[red]Error reading {pdf_path.name}: {e}[/red]")
-    return pages
-
-
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Split text into overlapping chunks."""
+
+def split_sentences(text, max_length=CHUNK_SIZE):
+    """Split text into sentences, cutting any longer than `max_length`."""
+    sentences = []
+    for block in text.splitlines():
+        for sentence in blingfire.text_to_sentences(block).splitlines():
+            # Block text is whitespace-collapsed, so sentences need no strip()
+            if not _HAS_CONTENT(sentence):
+                continue
+            sentences.extend(
+                sentence[start:start + max_length]
+                for start in range(0, len(sentence), max_length)
+            )
+    return sentences
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP_SENTENCES):
+    """Split text into chunks of whole sentences.
+
+    Each chunk starts with the last `overlap` sentences of the previous one,
+    dropping them if they would push the chunk past `chunk_size`.
+    """
     chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk)
-        start = end - overlap
+    current = []
+    length = 0  # length of " ".join(current)
+    has_new = False  # whether current holds sentences beyond the overlap
+
+    for sentence in split_sentences(text, chunk_size):
+        if has_new and length + 1 + len(sentence) > chunk_size:
+            chunks.append(" ".join(current))
+            current = current[-overlap:] if overlap else []
+            length = len(" ".join(current))
+            has_new = False
+
+        # Trim carried-over sentences that leave no room for the new one
+        while current and length + 1 + len(sentence) > chunk_size:
+            length -= len(current.pop(0)) + 1
+
+        current.append(sentence)
+        length = length + 1 + len(sentence) if len(current) > 1 else len(sentence)
+        has_new = True
+
+    if has_new:
+        chunks.append(" ".join(current))
     return chunks
 
 
+def iter_chunks(extracted, on_pdf_done=None):
+    """Yield `(doc_id, text, metadata)` for each chunk of extracted PDFs.
+
+    `extracted` yields `(pdf_path, pages)` pairs, as from `extract_all`.
+
+    Chunks repeated within a PDF are yielded once. Text shared between PDFs
+    is kept for each, so every rulebook stays citable.
+
+    `on_pdf_done` is called with each PDF path once all of its chunks have
+    been yielded.
+    """
+    doc_id = 0
+
+    for pdf_path, pages in extracted:
+        # Digests rather than chunk text, so memory stays small for large PDFs
+        seen_chunks = set()
+
+        for page_num, page_text in pages:
+            for chunk_idx, chunk in enumerate(chunk_text(page_text)):
+                # Skip text repeated within this PDF, such as running headers
+                # and footers
+                digest = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+                if digest in seen_chunks:
+                    continue
+                seen_chunks.add(digest)
+
+                yield f"doc_{doc_id}", chunk, {
+                    "source": pdf_path.name,
+                    "page": page_num,
+                    "chunk_index": chunk_idx,
+                }
+                doc_id += 1
+
+        if on_pdf_done is not None:
+            on_pdf_done(pdf_path)
+
+
+def embed_documents(model, documents, batch_size=EMBEDDING_BATCH_SIZE):
+    """Embed documents, batching chunks of similar length together.
+
+    Sorting by length keeps each encoder batch close to uniform, so little
+    compute is wasted on padding tokens. Embeddings are returned in the
+    original document order.
+    """
+    order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
+    sorted_embeddings = model.encode(
+        [documents[i] for i in order],
+        batch_size=batch_size,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=False,  # done by quantize_embeddings
+    )
+
+    # Invert the permutation to restore document order
+    positions = [0] * len(order)
+    for position, i in enumerate(order):
+        positions[i] = position
+    return sorted_embeddings[positions]
+
+
+def iter_batches(items, batch_size=INGEST_BATCH_SIZE):
+    """Group an iterable into lists of up to `batch_size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batch(model, batch):
+    """Embed a batch of `(doc_id, text, metadata)` chunks.
+
+    Returns keyword arguments for `collection.add`.
+    """
+    from .embeddings import dequantize_embeddings, quantize_embeddings
+
+    ids = [doc_id for doc_id, _, _ in batch]
+    documents = [text for _, text, _ in batch]
+    metadatas = [meta for _, _, meta in batch]
+
+    # Chroma stores the dequantized fp32 vectors; each chunk also keeps its
+    # int8 codes and scale so they can be moved to an int8-capable index
+    codes, scales = quantize_embeddings(embed_documents(model, documents))
+    for meta, code, scale in zip(metadatas, codes, scales.tolist()):
+        meta["embedding_q8"] = base64.b64encode(code.tobytes()).decode("ascii")
+        meta["embedding_scale"] = scale
+
+    return {
+        "embeddings": dequantize_embeddings(codes, scales),
+        "documents": documents,
+        "metadatas": metadatas,
+        "ids": ids,
+    }
+
+
 def ingest_documents():
     """Ingest all PDFs from the docs directory into ChromaDB."""
+    import chromadb
+
+    from .embeddings import load_embedding_model
+
     # Ensure directories exist
     CHROMADB_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -59,90 +202,70 @@ def ingest_documents():
 
     console.print(f"[bold]Found {len(pdf_files)} PDF files to process[/bold]\n")
 
+    # Start the extraction workers first, so they aren't forked from a
+    # process already running Chroma, CUDA or ONNX Runtime threads
+    extracted = extract_all(pdf_files)
+
     # Initialize ChromaDB with persistent storage
     client = chromadb.PersistentClient(path=str(CHROMADB_DIR))
 
-    # Create embedding function using sentence-transformers
-    embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBEDDING_MODEL
-    )
-
     # Delete existing collection if it exists and create fresh
     try:
         client.delete_collection(name=COLLECTION_NAME)
     except Exception:
         pass  # Collection doesn't exist yet
 
+    # Embeddings are computed here and passed in, so Chroma stores them as-is
     collection = client.create_collection(
         name=COLLECTION_NAME,
-        embedding_function=embedding_fn,
-        metadata={"description": "Scheme compliance documents"}
+        embedding_function=None,
+        metadata={
+            "description": "Scheme compliance documents",
+            "hnsw:space": HNSW_SPACE,
+            "hnsw:M": HNSW_M,
+            "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+            "hnsw:search_ef": HNSW_SEARCH_EF,
+        },
     )
 
-    all_documents = []
-    all_metadatas = []
-    all_ids = []
-    doc_id = 0
+    model = load_embedding_model()
 
-    with Progress(
+    # Chunks are embedded and flushed to Chroma batch by batch as PDFs are
+    # processed. Each batch is written on a background thread while the next
+    # one is encoded; at most one write is in flight, bounding memory.
+    total_chunks = 0
+    pending = None
+
+    with ThreadPoolExecutor(max_workers=1) as writer, Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        MofNCompleteColumn(),  # chunk totals aren't known up front, shown as N/?
         console=console,
+        refresh_per_second=4,
+        transient=True,
     ) as progress:
-        task = progress.add_task("Processing PDFs...", total=len(pdf_files))
-
-        for pdf_path in pdf_files:
-            progress.update(task, description=f"Processing {pdf_path.name}...")
-
-            # Extract text from each page
-            pages = extract_text_from_pdf(pdf_path)
-
-            for page_num, page_text in pages:
-                # Chunk the page text
-                chunks = chunk_text(page_text)
-
-                for chunk_idx, chunk in enumerate(chunks):
-                    all_documents.append(chunk)
-                    all_metadatas.append({
-                        "source": pdf_path.name,
-                        "page": page_num,
-                        "chunk_index": chunk_idx,
-                    })
-                    all_ids.append(f"doc_{doc_id}")
-                    doc_id += 1
-
-            progress.advance(task)
-
-    # Add all documents to collection
-    if all_documents:
-        console.print(f"\n[bold]Embedding {len(all_documents)} chunks...[/bold]")
-
-        # Add in batches to avoid memory issues
-        batch_size = 100
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            console=console,
-        ) as progress:
-            task = progress.add_task("Adding to vector store...", total=len(all_documents))
-
-            for i in range(0, len(all_documents), batch_size):
-                batch_docs = all_documents[i:i + batch_size]
-                batch_meta = all_metadatas[i:i + batch_size]
-                batch_ids = all_ids[i:i + batch_size]
-
-                collection.add(
-                    documents=batch_docs,
-                    metadatas=batch_meta,
-                    ids=batch_ids,
-                )
-                progress.advance(task, advance=len(batch_docs))
-
-        console.print(f"\n[green]Successfully ingested {len(all_documents)} chunks from {len(pdf_files)} PDFs[/green]")
+        pdf_task = progress.add_task("Processing PDFs...", total=len(pdf_files))
+        chunk_task = progress.add_task("Adding to vector store...", total=None)
+
+        def on_pdf_done(pdf_path):
+            progress.update(pdf_task, advance=1, description=f"Processed {pdf_path.name}")
+
+        for batch in iter_batches(iter_chunks(extracted, on_pdf_done)):
+            records = embed_batch(model, batch)
+            if pending is not None:
+                pending.result()
+                progress.update(chunk_task, completed=total_chunks)
+            pending = writer.submit(collection.add, **records)
+            total_chunks += len(batch)
+
+        if pending is not None:
+            pending.result()
+            progress.update(chunk_task, completed=total_chunks)
+
+    if total_chunks:
+        console.print(f"\n[green]Successfully ingested {total_chunks} chunks from {len(pdf_files)} PDFs[/green]")
         console.print(f"[dim]Vector store saved to: {CHROMADB_DIR}[/dim]")
     else:
         console.print("[yellow]No text content found in PDFs[/yellow]")
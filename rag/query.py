@@ -2,39 +2,49 @@
 
 import argparse
 import sys
+from functools import lru_cache
 
 import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
 from rich.console import Console
 from rich.panel import Panel
 from rich.markdown import Markdown
 
 from .config import (
     CHROMADB_DIR,
-    EMBEDDING_MODEL,
     COLLECTION_NAME,
     DEFAULT_TOP_K,
+    EMBEDDING_QUERY_PROMPT,
+    MMR_FETCH_FACTOR,
+    MMR_LAMBDA,
 )
+from .embeddings import CachedEmbeddingFunction, SentenceTransformerEmbedder
 
 console = Console()
 
 
+@lru_cache(maxsize=1)
+def get_embedding_function():
+    """Get the query embedding function, loading the model once per process."""
+    return CachedEmbeddingFunction(
+        SentenceTransformerEmbedder(prompt=EMBEDDING_QUERY_PROMPT)
+    )
+
+
+@lru_cache(maxsize=1)
 def get_collection():
-    """Get the ChromaDB collection."""
+    """Get the ChromaDB collection, opening it once per process."""
     if not CHROMADB_DIR.exists():
         console.print("[red]Error: Vector store not found. Run 'python -m rag.ingest' first.[/red]")
         sys.exit(1)
 
     client = chromadb.PersistentClient(path=str(CHROMADB_DIR))
 
-    embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBEDDING_MODEL
-    )
-
+    # Queries are embedded by get_embedding_function(), not by Chroma
     try:
         collection = client.get_collection(
             name=COLLECTION_NAME,
-            embedding_function=embedding_fn,
+            embedding_function=None,
         )
     except ValueError:
         console.print("[red]Error: Collection not found. Run 'python -m rag.ingest' first.[/red]")
@@ -43,16 +53,55 @@ def get_collection():
     return collection
 
 
+def mmr_select(embeddings, relevance, top_k, lambda_mult=MMR_LAMBDA):
+    """Pick `top_k` indices by maximal marginal relevance.
+
+    Each step takes the candidate with the best trade-off between relevance
+    to the query and similarity to the candidates already picked, so
+    near-duplicate chunks don't crowd out the results.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarity = vectors @ vectors.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(top_k, len(relevance)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
 def query(question, top_k=DEFAULT_TOP_K):
-    """Query the knowledge base and return relevant chunks."""
+    """Query the knowledge base and return relevant chunks.
+
+    Over-fetches candidates and reranks them with MMR to return `top_k`
+    diverse chunks.
+    """
     collection = get_collection()
 
+    query_embedding = get_embedding_function()([question])[0]
     results = collection.query(
-        query_texts=[question],
-        n_results=top_k,
+        query_embeddings=[query_embedding],
+        n_results=top_k * MMR_FETCH_FACTOR,
+        include=["documents", "metadatas", "distances", "embeddings"],
     )
 
-    return results
+    distances = results["distances"][0]
+    if not distances:
+        return results
+
+    relevance = 1 - np.asarray(distances, dtype=np.float32)
+    selected = mmr_select(results["embeddings"][0], relevance, top_k)
+
+    return {
+        key: [[results[key][0][i] for i in selected]]
+        for key in ("ids", "documents", "metadatas", "distances")
+    }
 
 
 def display_results(question, results):
@@ -70,13 +119,19 @@ def display_results(question, results):
 
     console.print(f"[bold]Found {len(documents)} relevant chunks:[/bold]\n")
 
-    for i, (doc, meta, dist) in enumerate(zip(documents, metadatas, distances), start=1):
+    # Convert cosine distances to similarity scores in one pass
+    similarities = 1.0 - np.asarray(distances, dtype=np.float32)
+    truncated = np.fromiter(
+        (len(doc) for doc in documents), dtype=np.int64, count=len(documents)
+    ) > 500
+
+    for i, (doc, meta) in enumerate(zip(documents, metadatas), start=1):
         source = meta.get("source", "Unknown")
         page = meta.get("page", "?")
-        similarity = 1 - dist  # Convert distance to similarity score
+        similarity = similarities[i - 1].item()
 
         # Truncate long chunks for display
-        display_text = doc[:500] + "..." if len(doc) > 500 else doc
+        display_text = doc[:500] + "..." if truncated[i - 1] else doc
 
         console.print(Panel(
             display_text,
@@ -98,6 +153,10 @@ def interactive_mode():
 
     collection = get_collection()
     doc_count = collection.count()
+
+    # Run one throwaway encode so the first real question doesn't pay for
+    # model initialisation (CUDA kernels, ONNX session, tokenizer)
+    get_embedding_function()(["warmup"])
     console.print(f"[dim]Loaded {doc_count} document chunks[/dim]\n")
 
     while True:
@@ -114,10 +173,7 @@ def interactive_mode():
             console.print("[dim]Goodbye![/dim]")
             break
 
-        results = collection.query(
-            query_texts=[question],
-            n_results=DEFAULT_TOP_K,
-        )
+        results = query(question)
 
         console.print()
         display_results(question, results)